@@ -0,0 +1,365 @@
+"""
+Agent运行录制/回放模块
+录制模式记录一次AgentExecutor运行中的每次LLM请求/响应和工具输入/输出，
+回放模式离线重放同一次运行（可注入延迟），用于得到可复现的性能基线。
+"""
+
+from collections import defaultdict,deque
+from datetime import datetime
+from pathlib import Path
+from typing import Any,Dict,List
+from uuid import UUID
+import asyncio
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage,BaseMessage
+from langchain_core.outputs import ChatGeneration,ChatResult
+from langchain_core.tools import BaseTool
+from langchain_core.tools.render import render_text_description
+from pydantic import PrivateAttr
+
+from agent_core import create_agent_executor,get_tools
+
+backend_root=Path(__file__).resolve().parent
+cassette_dir=backend_root/'data'/'cassettes'
+
+logging.basicConfig(level=logging.INFO)
+logger=logging.getLogger(__name__)
+
+CASSETTE_VERSION=1
+
+
+class CassetteMismatchError(RuntimeError):
+    """回放时Agent的请求与录制内容不一致"""
+
+
+def _prompt_hash(text:str)->str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+
+def _messages_text(messages:List[BaseMessage])->str:
+    return "\n".join(f"{message.type}: {message.content}" for message in messages)
+
+
+def step_timings(events:List[Dict[str,Any]])->List[Dict[str,Any]]:
+    """每一步的名称和耗时，用于和基线比较"""
+    return [
+        {"step":index,"type":event["type"],"name":event.get("name","llm"),"latency":event.get("latency",0.0)}
+        for index,event in enumerate(events)
+    ]
+
+
+class CassetteRecorder(BaseCallbackHandler):
+    """按发生顺序记录LLM和工具调用及其耗时，录制和回放计时共用"""
+    run_inline=True #在事件循环中直接执行回调，保证事件顺序和计时准确
+
+    def __init__(self):
+        self.events:List[Dict[str,Any]]=[]
+        self._pending:Dict[UUID,Dict[str,Any]]={}
+
+    def _start(self,run_id:UUID,event:Dict[str,Any]):
+        event["_start"]=time.perf_counter()
+        self.events.append(event)
+        self._pending[run_id]=event
+
+    def _end(self,run_id:UUID,**fields):
+        event=self._pending.pop(run_id,None)
+        if event is None:
+            return
+        event["latency"]=round(time.perf_counter()-event.pop("_start"),4)
+        event.update(fields)
+
+    def on_chat_model_start(self,serialized,messages,*,run_id,**kwargs):
+        self._start(run_id,{"type":"llm","prompt_hash":_prompt_hash(_messages_text(messages[0]))})
+
+    def on_llm_start(self,serialized,prompts,*,run_id,**kwargs):
+        self._start(run_id,{"type":"llm","prompt_hash":_prompt_hash(prompts[0])})
+
+    def on_llm_end(self,response,*,run_id,**kwargs):
+        self._end(run_id,output=response.generations[0][0].text)
+
+    def on_llm_error(self,error,*,run_id,**kwargs):
+        self._end(run_id,error=str(error))
+
+    def on_tool_start(self,serialized,input_str,*,run_id,**kwargs):
+        self._start(run_id,{"type":"tool","name":serialized.get("name",''),"input":input_str})
+
+    def on_tool_end(self,output,*,run_id,**kwargs):
+        self._end(run_id,output=str(getattr(output,"content",output)))
+
+    def on_tool_error(self,error,*,run_id,**kwargs):
+        self._end(run_id,error=str(error))
+
+
+class ReplayChatModel(BaseChatModel):
+    """按顺序返回录制的LLM响应，并校验请求与录制时一致"""
+    events:List[Dict[str,Any]]
+    latency_scale:float=0.0
+    extra_latency:float=0.0
+    strict:bool=True
+    _cursor:int=PrivateAttr(default=0)
+
+    @property
+    def _llm_type(self)->str:
+        return "cassette-replay"
+
+    def _next_event(self,messages:List[BaseMessage])->Dict[str,Any]:
+        if self._cursor>=len(self.events):
+            raise CassetteMismatchError(f"录制中只有{len(self.events)}次LLM调用，回放请求了更多")
+        event=self.events[self._cursor]
+        self._cursor+=1
+        prompt_hash=_prompt_hash(_messages_text(messages))
+        if prompt_hash!=event["prompt_hash"]:
+            message=f"第{self._cursor}次LLM调用的提示词与录制不一致"
+            if self.strict:
+                raise CassetteMismatchError(message)
+            logger.warning(message)
+        return event
+
+    def _result(self,event:Dict[str,Any])->ChatResult:
+        if "error" in event:
+            raise RuntimeError(event["error"])
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=event["output"]))])
+
+    def _generate(self,messages,stop=None,run_manager=None,**kwargs)->ChatResult:
+        event=self._next_event(messages)
+        time.sleep(event.get("latency",0.0)*self.latency_scale+self.extra_latency)
+        return self._result(event)
+
+    async def _agenerate(self,messages,stop=None,run_manager=None,**kwargs)->ChatResult:
+        event=self._next_event(messages)
+        await asyncio.sleep(event.get("latency",0.0)*self.latency_scale+self.extra_latency)
+        return self._result(event)
+
+
+class ReplayTool(BaseTool):
+    """按顺序返回某个工具录制的输出，提示词中的工具描述使用录制时渲染的文本"""
+    name:str
+    description:str
+    recorded:Any
+    latency_scale:float=0.0
+    extra_latency:float=0.0
+    strict:bool=True
+
+    def _next_event(self,tool_input:str)->Dict[str,Any]:
+        if not self.recorded:
+            raise CassetteMismatchError(f"工具{self.name}的录制调用已用完")
+        event=self.recorded.popleft()
+        if event["input"]!=tool_input:
+            message=f"工具{self.name}的输入与录制不一致: {tool_input!r} != {event['input']!r}"
+            if self.strict:
+                raise CassetteMismatchError(message)
+            logger.warning(message)
+        return event
+
+    def _delay(self,event:Dict[str,Any])->float:
+        return event.get("latency",0.0)*self.latency_scale+self.extra_latency
+
+    def _output(self,event:Dict[str,Any])->str:
+        if "error" in event:
+            raise RuntimeError(event["error"])
+        return event["output"]
+
+    def _run(self,tool_input:str,run_manager=None)->str:
+        event=self._next_event(tool_input)
+        time.sleep(self._delay(event))
+        return self._output(event)
+
+    async def _arun(self,tool_input:str,run_manager=None)->str:
+        event=self._next_event(tool_input)
+        await asyncio.sleep(self._delay(event))
+        return self._output(event)
+
+
+def create_replay_tools(cassette:Dict[str,Any],latency_scale:float=0.0,extra_latency:float=0.0,strict:bool=True)->List[ReplayTool]:
+    """用录制的工具输出构造同名工具"""
+    recorded=defaultdict(deque)
+    for event in cassette["events"]:
+        if event["type"]=="tool":
+            recorded[event["name"]].append(event)
+    return [
+        ReplayTool(
+            name=tool["name"],description=tool["description"],recorded=recorded[tool["name"]],
+            latency_scale=latency_scale,extra_latency=extra_latency,strict=strict
+        )
+        for tool in cassette["tools"]
+    ]
+
+
+def _cassette_path(name:str)->Path:
+    return Path(name) if name.endswith(".json.gz") else cassette_dir/f"{name}.json.gz"
+
+
+def save_cassette(cassette:Dict[str,Any],name:str)->Path:
+    path=_cassette_path(name)
+    path.parent.mkdir(parents=True,exist_ok=True)
+    with gzip.open(path,'wt',encoding='utf-8') as f:
+        json.dump(cassette,f,ensure_ascii=False,separators=(',',':'))
+    logger.info(f"录制已保存到：{path}")
+    return path
+
+
+def load_cassette(name:str)->Dict[str,Any]:
+    with gzip.open(_cassette_path(name),'rt',encoding='utf-8') as f:
+        cassette=json.load(f)
+    if cassette.get("version")!=CASSETTE_VERSION:
+        raise ValueError(f"不支持的录制版本: {cassette.get('version')}")
+    return cassette
+
+
+async def record_run(inputs:Dict[str,Any],name:str,llm=None,tools=None):
+    """运行一次Agent并录制，返回(运行结果, 录制文件路径)
+
+    llm和tools默认使用agent_core中的在线配置
+    """
+    tools=tools or get_tools()
+    agent_executor=create_agent_executor(llm=llm,tools=tools)
+    recorder=CassetteRecorder()
+    start=time.perf_counter()
+    result=await agent_executor.ainvoke(inputs,config={"callbacks":[recorder]})
+    cassette={
+        "version":CASSETTE_VERSION,
+        "recorded_at":datetime.now().isoformat(),
+        "inputs":inputs,
+        "tools":[{"name":tool.name,"description":tool.description} for tool in tools],
+        #工具描述的渲染结果取决于工具类型（如@tool生成的工具会带函数签名），直接录制渲染后的文本
+        "tools_text":render_text_description(tools),
+        "events":recorder.events,
+        "output":result.get("output",''),
+        "duration":round(time.perf_counter()-start,4),
+    }
+    return result,save_cassette(cassette,name)
+
+
+async def replay_run(name:str,latency_scale:float=0.0,extra_latency:float=0.0,strict:bool=True)->Dict[str,Any]:
+    """离线重放录制的运行，返回结果、总耗时和每一步耗时
+
+    latency_scale=1.0按录制时的真实耗时注入延迟，extra_latency为每次调用额外增加的秒数
+    """
+    cassette=load_cassette(name)
+    llm=ReplayChatModel(
+        events=[event for event in cassette["events"] if event["type"]=="llm"],
+        latency_scale=latency_scale,extra_latency=extra_latency,strict=strict
+    )
+    tools=create_replay_tools(cassette,latency_scale,extra_latency,strict)
+    tools_text=cassette.get("tools_text")
+    agent_executor=create_agent_executor(
+        llm=llm,tools=tools,
+        tools_renderer=(lambda _tools:tools_text) if tools_text is not None else None
+    )
+    recorder=CassetteRecorder()
+    start=time.perf_counter()
+    result=await agent_executor.ainvoke(cassette["inputs"],config={"callbacks":[recorder]})
+    duration=time.perf_counter()-start
+    if strict and result.get("output")!=cassette["output"]:
+        raise CassetteMismatchError("回放的最终输出与录制不一致")
+    return {"output":result.get("output",''),"duration":duration,"steps":step_timings(recorder.events)}
+
+
+def compare_steps(baseline:List[Dict[str,Any]],current:List[Dict[str,Any]],tolerance:float=0.2,min_delta:float=0.05)->List[str]:
+    """逐步比较耗时，返回超过基线(1+tolerance)倍且增量大于min_delta秒的步骤描述"""
+    regressions=[]
+    for before,after in zip(baseline,current):
+        delta=after["latency"]-before["latency"]
+        if delta>min_delta and after["latency"]>before["latency"]*(1+tolerance):
+            regressions.append(f"第{after['step']}步 {after['name']}: {before['latency']:.3f}s -> {after['latency']:.3f}s")
+    if len(baseline)!=len(current):
+        regressions.append(f"步骤数变化: {len(baseline)} -> {len(current)}")
+    return regressions
+
+
+# Record, replay or self-check an agent run from the command line
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description="录制/回放Agent运行")
+    subparsers=parser.add_subparsers(dest="mode",required=True)
+    record_parser=subparsers.add_parser("record",help="在线运行并录制")
+    record_parser.add_argument("topic")
+    record_parser.add_argument("name")
+    replay_parser=subparsers.add_parser("replay",help="离线回放录制")
+    replay_parser.add_argument("name")
+    replay_parser.add_argument("--latency-scale",type=float,default=0.0)
+    replay_parser.add_argument("--extra-latency",type=float,default=0.0)
+    replay_parser.add_argument("--baseline",help="与该录制中每一步的耗时比较")
+    subparsers.add_parser("selfcheck",help="用假LLM和桩工具离线检查录制→回放")
+    args=parser.parse_args()
+
+    if args.mode=="selfcheck":
+        from langchain_community.chat_models.fake import FakeListChatModel
+        from langchain_core.tools import tool
+        import tempfile
+
+        @tool
+        def web_search(query:str)->str:
+            """搜索网页，返回相关内容"""
+            return f"关于{query}的搜索结果"
+
+        class SlowSummaryTool(BaseTool):
+            name:str="summarize"
+            description:str="总结一段文本"
+            def _run(self,text:str,run_manager=None)->str:
+                time.sleep(0.2)
+                return f"摘要：{text}"
+            async def _arun(self,text:str,run_manager=None)->str:
+                await asyncio.sleep(0.2)
+                return f"摘要：{text}"
+
+        fake_llm=FakeListChatModel(responses=[
+            "Thought: 需要先搜索\nAction: web_search\nAction Input: 新能源汽车",
+            "Thought: 需要总结搜索结果\nAction: summarize\nAction Input: 关于新能源汽车的搜索结果",
+            "Thought: 我现在知道最终答案了\nFinal Answer: 新能源汽车研究报告",
+        ])
+        inputs={"input":"新能源汽车","current_time":"2025年01月01日"}
+        with tempfile.TemporaryDirectory() as tmp:
+            path=str(Path(tmp)/"selfcheck.json.gz")
+            result,_=asyncio.run(record_run(inputs,path,llm=fake_llm,tools=[web_search,SlowSummaryTool()]))
+            cassette=load_cassette(path)
+            assert result["output"]=="新能源汽车研究报告"
+            assert [event["type"] for event in cassette["events"]]==["llm","tool","llm","tool","llm"]
+            #@tool生成的工具渲染时带函数签名，回放必须使用录制的文本而不是名称和描述
+            assert "web_search(query: str)" in cassette["tools_text"]
+
+            replayed=asyncio.run(replay_run(path))
+            assert replayed["output"]==result["output"]
+            assert [step["type"] for step in replayed["steps"]]==[event["type"] for event in cassette["events"]]
+            assert [step["name"] for step in replayed["steps"]]==[step["name"] for step in step_timings(cassette["events"])]
+            assert replayed["duration"]<0.2 #不注入延迟时不等待工具录制耗时
+
+            replayed=asyncio.run(replay_run(path,latency_scale=1.0))
+            assert replayed["duration"]>=0.2
+            assert not compare_steps(step_timings(cassette["events"]),replayed["steps"],min_delta=0.1)
+            assert compare_steps(step_timings(cassette["events"]),asyncio.run(replay_run(path,latency_scale=1.0,extra_latency=0.15))["steps"])
+
+            cassette["events"][1]["input"]="其他主题"
+            save_cassette(cassette,path)
+            try:
+                asyncio.run(replay_run(path))
+            except CassetteMismatchError:
+                pass
+            else:
+                raise AssertionError("录制的工具输入被改动后回放应当失败")
+        print("agent cassette self-check passed")
+    elif args.mode=="record":
+        _,path=asyncio.run(record_run({
+            "input":args.topic,
+            "current_time":datetime.now().strftime("%Y年%m月%d日")
+        },args.name))
+        print(f"已录制: {path}")
+    else:
+        replayed=asyncio.run(replay_run(args.name,args.latency_scale,args.extra_latency))
+        print(f"回放耗时: {replayed['duration']:.2f}秒，共{len(replayed['steps'])}步")
+        for step in replayed["steps"]:
+            print(f"  {step['step']:>3} {step['type']:<4} {step['name']:<16} {step['latency']:.3f}s")
+        if args.baseline:
+            baseline=load_cassette(args.baseline)
+            regressions=compare_steps(step_timings(baseline["events"]),replayed["steps"])
+            for regression in regressions:
+                print(f"性能回退: {regression}")
+            raise SystemExit(1 if regressions else 0)
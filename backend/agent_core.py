@@ -10,7 +10,8 @@ from langchain_tavily import TavilySearch
 from langchain.prompts import PromptTemplate
 from langchain.agents import AgentExecutor, create_react_agent
 from langchain_community.tools import YahooFinanceNewsTool, ArxivQueryRun
-from langchain.memory.buffer import ConversationBufferMemory
+from langchain.memory import ConversationBufferWindowMemory
+from report_builder import ReportBuilder
 from datetime import datetime
 #loading environment parameter
 load_dotenv()
@@ -183,32 +184,49 @@ Thought: {agent_scratchpad}
 '''
 Template=PromptTemplate.from_template(template=template_content)
 
-def create_agent_executor():
-    """创建一个新的Agent Executor实例，支持对话记忆"""
+def create_agent_executor(memory_window:int=5,llm=None,tools=None,use_memory:bool=True,tools_renderer=None):
+    """创建一个新的Agent Executor实例，支持对话记忆
+
+    llm和tools默认使用全局LLM和get_tools()，回放模式下替换为录制数据
+    use_memory=False时不带对话记忆，调用方需要自行传入chat_history
+    tools_renderer用于替换提示词中工具描述的渲染方式，回放模式下直接使用录制的文本
+    """
     print("正在创建Agent Executor...")
     
     
-    # 创建对话记忆
-    memory = ConversationBufferMemory(
+    # 创建对话记忆，只保留最近memory_window轮，避免完整报告在记忆中无限累积
+    memory = ConversationBufferWindowMemory(
+        k=memory_window,
         memory_key="chat_history",
         return_messages=True,
         input_key="input",
         output_key="output"
-    )
+    ) if use_memory else None
     
+    llm=llm or LLM
+    tools=tools or get_tools()
+
     #Create ReAct Agent
-    agent=create_react_agent(llm=LLM,tools=get_tools(),prompt=Template)
+    if tools_renderer:
+        agent=create_react_agent(llm=llm,tools=tools,prompt=Template,tools_renderer=tools_renderer)
+    else:
+        agent=create_react_agent(llm=llm,tools=tools,prompt=Template)
 
     #create an Agent Executor
     agent_executor=AgentExecutor(
         agent=agent,
-        tools= get_tools(),
+        tools=tools,
         verbose=True,
         handle_parsing_errors=True,
         memory=memory
     )
     return agent_executor
 
+def create_report_builder():
+    """创建分章节报告生成器，与Agent共用同一个LLM和工具配置"""
+    print("正在创建Report Builder...")
+    return ReportBuilder(llm=LLM,tools=get_tools())
+
 # Test core logic of Agent
 
 if __name__=="__main__":
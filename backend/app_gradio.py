@@ -2,8 +2,11 @@ from ssl_config import configure_ssl
 
 import gradio as gr
 from datetime import datetime
-from agent_core import create_agent_executor
+from agent_core import create_agent_executor,create_report_builder
 from conversation_manager import ConversationManager,ConversationTimer
+from report_builder import ResearchReport,match_sections
+from citation_checker import CachedFetcher,verify_citations
+from request_coalescer import RequestCoalescer
 import logging
 import re
 import pypandoc
@@ -14,20 +17,35 @@ logging.basicConfig(level=logging.INFO)
 logger=logging.getLogger(__name__)
 
 #Configure Global Conversation Manager
-conversation_manager=ConversationManager(max_history_length=5,max_session_age_hours=12)
+conversation_manager=ConversationManager(max_history_length=5,max_session_age_hours=12,max_memory_mb=256)
+
+#Configure citation fetcher, its on-disk cache is shared by all sessions
+citation_fetcher=CachedFetcher(max_concurrency=16,per_host_limit=2)
+
+#Configure request coalescer for identical concurrent research topics
+research_coalescer=RequestCoalescer(ttl_seconds=300)
 
 #Initialize agent instance
 
 agent_executor_instance=None
+report_builder_instance=None
 
 def initialize_agent():
     """Initialize Agent Executor"""
     global agent_executor_instance #clarify the global variable
     if agent_executor_instance is None:
         logger.info("Initializing Agent Executor...")
-        agent_executor_instance=create_agent_executor()
+        agent_executor_instance=create_agent_executor(memory_window=conversation_manager.max_history_length)
     return agent_executor_instance
 
+def initialize_report_builder():
+    """Initialize section-wise Report Builder"""
+    global report_builder_instance
+    if report_builder_instance is None:
+        logger.info("Initializing Report Builder...")
+        report_builder_instance=create_report_builder()
+    return report_builder_instance
+
 def ensure_session_exists():
     if not conversation_manager.get_active_session():
         logger.info("Creating New Session...")
@@ -38,10 +56,17 @@ def ensure_session_exists():
             logger.error("Failed to Create New Session")
 
 
+async def report_snapshots(topic,current_time):
+    """逐章节生成报告，产出(渲染后的Markdown, 报告数据)快照供合并请求分发"""
+    async for partial in initialize_report_builder().astream_report(topic,current_time):
+        yield partial.render(),partial.to_dict()
+
 #定义gradio中要用到的接口函数
 async def research_interface(topic, is_follow_up=False):#默认初始问题而非追问
+    """流式返回研究结果：初始研究按章节逐个生成，追问只重新生成涉及的章节"""
     if not topic:
-        return "Error: please enter a research topic",conversation_manager.get_formatted_history()
+        yield "Error: please enter a research topic",conversation_manager.get_formatted_history()
+        return
     
     ensure_session_exists() #如果没有会话 这个函数会创建一个新会话
 
@@ -54,11 +79,39 @@ async def research_interface(topic, is_follow_up=False):#默认初始问题而
     try:
         async with TIMER:
             agent_executor=initialize_agent()
-            response=await agent_executor.ainvoke({
-                "input":topic,
-                "current_time":current_time
-            })
-            ai_response=response.get("output","No valid response")
+            report=conversation_manager.get_active_report() if is_follow_up else None
+            sections=match_sections(topic) if report else []
+            if sections:
+                #追问命中报告中的具体章节，只重写这些章节
+                logger.info(f"Partial report update: {sections}")
+                async for partial in initialize_report_builder().astream_update(report,sections,topic,current_time):
+                    conversation_manager.set_active_report(partial) #刷新会话内存统计
+                    ai_response=partial.render()
+                    yield ai_response,conversation_manager.get_formatted_history()
+            elif is_follow_up:
+                response=await agent_executor.ainvoke({
+                    "input":topic,
+                    "current_time":current_time
+                })
+                ai_response=response.get("output","No valid response")
+                #Agent按模板重写了整份报告时，同步为新的分章节报告
+                rewritten=ResearchReport.from_markdown(report.topic if report else topic,ai_response,current_time)
+                if rewritten.is_complete():
+                    conversation_manager.set_active_report(rewritten)
+            else:
+                #相同主题的并发初始研究只运行一次，结果分发给所有等待者
+                report_data=None
+                async for ai_response,report_data in research_coalescer.stream(topic,lambda:report_snapshots(topic,current_time)):
+                    yield ai_response,conversation_manager.get_formatted_history()
+                if report_data:
+                    #每个会话持有独立的报告对象，追问时的局部更新互不影响
+                    conversation_manager.set_active_report(ResearchReport.from_dict(report_data))
+            if sections or not is_follow_up:
+                #报告不经过Agent生成，手动写入Agent记忆以便后续追问引用
+                agent_executor.memory.save_context({"input":topic},{"output":ai_response})
+            if ai_response:
+                #检查引用来源链接，在报告中标注失效或虚构的链接
+                ai_response,_=await verify_citations(ai_response,citation_fetcher)
            
     except Exception as e:
         error_occurred=True
@@ -78,18 +131,21 @@ async def research_interface(topic, is_follow_up=False):#默认初始问题而
     conversation_manager.add_chat_history(single_conversation)
 
     #返回结果和更新的对话历史
-    return ai_response,conversation_manager.get_formatted_history()
+    yield ai_response,conversation_manager.get_formatted_history()
 
 #定义追问的接口函数
 async def follow_up_question(follow_up_topic:str):
     if not follow_up_topic:
-        return "Error: please enter a follow-up question",conversation_manager.get_formatted_history()
+        yield "Error: please enter a follow-up question",conversation_manager.get_formatted_history()
+        return
     
     #检查是否有对话历史
     if not conversation_manager.get_active_session() or not conversation_manager.get_active_session().turns:
-        return "Error: please start an initial research first",conversation_manager.get_formatted_history()
+        yield "Error: please start an initial research first",conversation_manager.get_formatted_history()
+        return
     
-    return await research_interface(follow_up_topic, is_follow_up=True)
+    async for output in research_interface(follow_up_topic, is_follow_up=True):
+        yield output
 
     
 #定义几个按钮函数 清空对话， 导出对话， 获取对话统计
@@ -154,6 +210,8 @@ def get_conversation_stats():
     stats+=f"创建时间: {session.created_at}\n"
     stats+=f"总轮次: {len(session.turns)}\n"
     stats+=f"最后活动: {session.last_activity}\n"
+    memory_stats=conversation_manager.get_memory_stats()
+    stats+=f"会话内存: {session.memory_bytes/1024:.1f}KB (全部会话 {memory_stats['total_memory_bytes']/1024/1024:.2f}MB / 上限 {memory_stats['max_memory_bytes']/1024/1024:.0f}MB)\n"
 
     if session.turns:
         valid_times=[turn.processing_time if turn.processing_time is not None else 0.0 for turn in session.turns]
@@ -0,0 +1,338 @@
+from dataclasses import dataclass,asdict
+from typing import Dict,Optional,Iterable
+from pathlib import Path
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import socket
+import time
+
+import aiohttp
+
+backend_root=Path(__file__).resolve().parent
+cache_dir=backend_root/'data'/'fetch_cache'
+
+logging.basicConfig(level=logging.INFO)
+logger=logging.getLogger(__name__)
+
+#来源列表中的一行，例如 "-   **[Source 1]:** https://example.com"
+#URL可能写成裸URL、<url>或Markdown链接[标题](url)
+SOURCE_LINE_PATTERN=re.compile(
+    r"^[ \t]*[-*][ \t]*\**\[(?:Source|Src)\s*(?P<number>\d+)\]\**:?\**[ \t]*"
+    r"(?:\[[^\]\n]*\]\((?P<link_url>[^)\s]+)\)|<(?P<bracket_url>[^>\s]+)>|(?P<bare_url>\S+)).*$",
+    re.M
+)
+CITATION_PATTERN=re.compile(r"\[(?:Source|Src)\s*(\d+)\]")
+#只有这些状态码说明链接确实失效；401/403/429等通常是站点拒绝爬虫，只能算未验证
+DEAD_STATUSES=(404,410)
+#只有域名确定不存在或URL无效才算失效；连接失败、临时DNS故障、证书错误都可能是暂时的，只能算未验证
+DEAD_REASONS=("dns_error","invalid_url")
+#getaddrinfo返回这些错误码说明域名确定不存在，EAI_AGAIN等其他错误码是暂时故障
+PERMANENT_DNS_ERRORS=tuple(getattr(socket,name) for name in ("EAI_NONAME","EAI_NODATA") if hasattr(socket,name))
+#很多新闻站点会拒绝aiohttp默认的User-Agent
+BROWSER_HEADERS={
+    "User-Agent":"Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0 Safari/537.36",
+    "Accept":"text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language":"zh-CN,zh;q=0.9,en;q=0.8",
+}
+
+
+@dataclass
+class FetchResult:
+    """单个URL的检查结果"""
+    url:str
+    status:int=0 #HTTP状态码，0表示请求未得到响应
+    ok:bool=False
+    reason:str=''
+    from_cache:bool=False
+    etag:str=''
+    last_modified:str=''
+    checked_at:float=0.0
+
+    def to_dict(self):
+        return asdict(self)
+
+    @property
+    def dead(self)->bool:
+        """链接确定失效（404/410、域名不存在、URL无效）"""
+        return self.status in DEAD_STATUSES or self.reason in DEAD_REASONS
+
+    @property
+    def verified(self)->bool:
+        """结果是确定的（可访问或确定失效），未验证的结果不写入缓存"""
+        return self.ok or self.dead
+
+
+class CachedFetcher:
+    """并发URL检查器：全局并发上限+每个域名并发上限，响应状态缓存在磁盘并通过ETag/Last-Modified重新验证"""
+    def __init__(self,max_concurrency:int=16,per_host_limit:int=2,timeout:float=10,
+                 cache_ttl_seconds:float=3600,cache_path:Optional[Path]=None):
+        self.max_concurrency=max_concurrency
+        self.per_host_limit=per_host_limit
+        self.timeout=timeout
+        self.cache_ttl_seconds=cache_ttl_seconds
+        self.cache_path=Path(cache_path) if cache_path else cache_dir
+        self.cache_path.mkdir(parents=True,exist_ok=True)
+
+    async def fetch_all(self,urls:Iterable[str])->Dict[str,FetchResult]:
+        unique_urls=list(dict.fromkeys(urls))
+        if not unique_urls:
+            return {}
+        #连接池同时限制总并发和每个域名的并发，超出的请求在连接池中排队
+        connector=aiohttp.TCPConnector(limit=self.max_concurrency,limit_per_host=self.per_host_limit)
+        #不设置总超时：排队等待连接的时间不应计入单个链接的超时
+        timeout=aiohttp.ClientTimeout(total=None,sock_connect=self.timeout,sock_read=self.timeout)
+        async with aiohttp.ClientSession(connector=connector,timeout=timeout,headers=BROWSER_HEADERS) as session:
+            results=await asyncio.gather(*(self.fetch(session,url) for url in unique_urls))
+        return {result.url:result for result in results}
+
+    async def fetch(self,session:aiohttp.ClientSession,url:str)->FetchResult:
+        cached=self._load_cache(url)
+        if cached and time.time()-cached.checked_at<self.cache_ttl_seconds:
+            cached.from_cache=True
+            return cached
+
+        headers={}
+        if cached and cached.ok:
+            if cached.etag:
+                headers["If-None-Match"]=cached.etag
+            if cached.last_modified:
+                headers["If-Modified-Since"]=cached.last_modified
+        try:
+            #只需要状态码和缓存校验头，不读取响应体
+            async with session.get(url,headers=headers,allow_redirects=True) as response:
+                if response.status==304 and cached:
+                    cached.checked_at=time.time()
+                    cached.from_cache=True
+                    self._save_cache(cached)
+                    return cached
+                result=FetchResult(
+                    url=url,
+                    status=response.status,
+                    ok=response.status<400,
+                    reason=response.reason or '',
+                    etag=response.headers.get("ETag",''),
+                    last_modified=response.headers.get("Last-Modified",''),
+                    checked_at=time.time(),
+                )
+        except aiohttp.InvalidURL:
+            result=FetchResult(url=url,reason="invalid_url",checked_at=time.time())
+        except aiohttp.ClientSSLError:
+            #证书错误等TLS问题需在ClientConnectorError之前处理，其子类没有os_error属性
+            result=FetchResult(url=url,reason="ssl_error",checked_at=time.time())
+        except aiohttp.ClientConnectorError as e:
+            os_error=getattr(e,"os_error",None)
+            if isinstance(os_error,socket.gaierror):
+                reason="dns_error" if os_error.errno in PERMANENT_DNS_ERRORS else "dns_temporary_error"
+            else:
+                reason="connection_error"
+            result=FetchResult(url=url,reason=reason,checked_at=time.time())
+        except asyncio.TimeoutError:
+            result=FetchResult(url=url,reason="timeout",checked_at=time.time())
+        except aiohttp.ClientError as e:
+            result=FetchResult(url=url,reason=f"client_error: {e}",checked_at=time.time())
+        except Exception as e:
+            #单个URL的意外错误不能让整批检查失败
+            logger.warning(f"检查链接时出现意外错误 {url}: {e}")
+            result=FetchResult(url=url,reason=f"unexpected_error: {e}",checked_at=time.time())
+        #超时、连接失败、403、429等结果不确定，不写缓存，下次重新检查
+        if result.verified:
+            self._save_cache(result)
+        return result
+
+    def _cache_file(self,url:str)->Path:
+        return self.cache_path/f"{hashlib.sha256(url.encode('utf-8')).hexdigest()}.json"
+
+    def _load_cache(self,url:str)->Optional[FetchResult]:
+        path=self._cache_file(url)
+        if not path.exists():
+            return None
+        try:
+            with open(path,'r',encoding='utf-8') as f:
+                return FetchResult(**json.load(f))
+        except (OSError,ValueError,TypeError) as e:
+            logger.warning(f"读取URL缓存失败 {url}: {e}")
+            return None
+
+    def _save_cache(self,result:FetchResult):
+        data=result.to_dict()
+        data["from_cache"]=False
+        with open(self._cache_file(result.url),'w',encoding='utf-8') as f:
+            json.dump(data,f,ensure_ascii=False)
+
+
+def _source_url(match)->str:
+    return match.group("link_url") or match.group("bracket_url") or match.group("bare_url")
+
+
+def extract_cited_sources(report_text:str)->Dict[int,str]:
+    """从报告末尾的来源列表中提取 {Source编号: URL}"""
+    return {int(match.group("number")):_source_url(match) for match in SOURCE_LINE_PATTERN.finditer(report_text)}
+
+
+def describe_problem(result:Optional[FetchResult])->str:
+    """返回链接问题描述，链接正常时返回空字符串"""
+    if result is None or result.ok:
+        return ''
+    if result.reason=="dns_error":
+        return "⚠️ 疑似虚构链接（域名无法解析）"
+    if result.reason=="invalid_url":
+        return "⚠️ 疑似虚构链接（URL格式无效）"
+    if result.status in DEAD_STATUSES:
+        return f"⚠️ 链接失效（HTTP {result.status}）"
+    if result.reason=="timeout":
+        return "❔ 链接未能验证（检查超时）"
+    if result.reason=="connection_error":
+        return "❔ 链接未能验证（无法连接）"
+    if result.reason=="dns_temporary_error":
+        return "❔ 链接未能验证（域名解析暂时失败）"
+    if result.reason=="ssl_error":
+        return "❔ 链接未能验证（TLS证书错误）"
+    if result.status:
+        return f"❔ 链接未能验证（HTTP {result.status}）"
+    return "❔ 链接未能验证"
+
+
+async def verify_citations(report_text:str,fetcher:Optional[CachedFetcher]=None):
+    """检查Final Answer中引用的来源链接，返回(标注后的报告, {URL: FetchResult})
+
+    失效或虚构的链接在来源列表中就地标注；正文引用了来源列表中不存在的编号时也一并标注。
+    """
+    sources=extract_cited_sources(report_text)
+    fetcher=fetcher or CachedFetcher()
+    urls=[url for url in sources.values() if url.startswith(("http://","https://"))]
+    start=time.perf_counter()
+    results=await fetcher.fetch_all(urls)
+    logger.info(f"检查了{len(results)}个来源链接，耗时{time.perf_counter()-start:.2f}秒")
+
+    def mark_source(match):
+        url=_source_url(match)
+        if not url.startswith(("http://","https://")):
+            problem="⚠️ 疑似虚构链接（不是有效URL）"
+        else:
+            problem=describe_problem(results.get(url))
+        line=match.group(0)
+        return f"{line} {problem}" if problem else line
+
+    def mark_citation(match):
+        number=int(match.group(1))
+        return match.group(0) if number in sources else f"{match.group(0)}⚠️(来源缺失)"
+
+    annotated=SOURCE_LINE_PATTERN.sub(mark_source,report_text)
+    if sources:
+        body,sep,tail=annotated.partition("引用信息来源")
+        annotated=CITATION_PATTERN.sub(mark_citation,body)+sep+tail
+    return annotated,results
+
+
+# Test citation checker against a local HTTP server
+
+if __name__=="__main__":
+    from http.server import ThreadingHTTPServer,BaseHTTPRequestHandler
+    import shutil
+    import ssl
+    import subprocess
+    import tempfile
+    import threading
+
+    user_agents=[]
+
+    class StandInHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            user_agents.append(self.headers.get("User-Agent",''))
+            if self.path in ("/ok","/linked","/bracketed"):
+                if self.headers.get("If-None-Match")=='"v1"':
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("ETag",'"v1"')
+                self.end_headers()
+                self.wfile.write(b"ok")
+            elif self.path=="/forbidden":
+                self.send_response(403)
+                self.end_headers()
+            else:
+                self.send_response(404)
+                self.end_headers()
+        def log_message(self,*args):
+            pass
+
+    def start_server(server):
+        threading.Thread(target=server.serve_forever,daemon=True).start()
+        return server
+
+    servers=[start_server(ThreadingHTTPServer(("127.0.0.1",0),StandInHandler))]
+    base=f"http://127.0.0.1:{servers[0].server_port}"
+    with tempfile.TemporaryDirectory() as tmp:
+        source_lines=[
+            f"{base}/ok",
+            f"{base}/missing",
+            "https://no-such-host.invalid/report",
+            f"[行业报告]({base}/linked)",
+            f"<{base}/bracketed>",
+            f"{base}/forbidden",
+            #对HTTP端口发起HTTPS请求，TLS握手失败
+            f"https://127.0.0.1:{servers[0].server_port}/ok",
+            #端口1上没有服务，连接被拒绝
+            "http://127.0.0.1:1/report",
+        ]
+        if shutil.which("openssl"):
+            #自签名证书的HTTPS服务，触发证书校验错误
+            cert_file,key_file=Path(tmp)/"cert.pem",Path(tmp)/"key.pem"
+            subprocess.run(
+                ["openssl","req","-x509","-newkey","rsa:2048","-nodes","-days","1","-subj","/CN=127.0.0.1",
+                 "-keyout",str(key_file),"-out",str(cert_file)],
+                check=True,capture_output=True
+            )
+            tls_server=ThreadingHTTPServer(("127.0.0.1",0),StandInHandler)
+            context=ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(cert_file,key_file)
+            tls_server.socket=context.wrap_socket(tls_server.socket,server_side=True)
+            servers.append(start_server(tls_server))
+            source_lines.append(f"https://127.0.0.1:{tls_server.server_port}/ok")
+        report=(
+            "## 一、 行业概览\n\n市场规模 [Source 1]，供需 [Source 2]，周期 [Source 20]\n\n"
+            "---\n### ※ 引用信息来源\n\n"
+            +"".join(f"-   **[Source {index+1}]:** {line}\n" for index,line in enumerate(source_lines))
+        )
+        assert extract_cited_sources(report)[4]==f"{base}/linked"
+        assert extract_cited_sources(report)[5]==f"{base}/bracketed"
+        try:
+            #cache_ttl_seconds=0 使第二次检查走ETag重新验证
+            fetcher=CachedFetcher(cache_path=Path(tmp)/"cache",cache_ttl_seconds=0)
+            annotated,results=asyncio.run(verify_citations(report,fetcher))
+            print(annotated)
+            lines={int(number):line for number,line in re.findall(r"^-.*?\[Source (\d+)\](.*)$",annotated,re.M)}
+            assert "⚠️" not in lines[1] and "❔" not in lines[1]
+            assert "链接失效（HTTP 404）" in lines[2]
+            assert "疑似虚构链接（域名无法解析）" in lines[3]
+            assert "⚠️" not in lines[4] and "⚠️" not in lines[5]
+            assert "链接未能验证（HTTP 403）" in lines[6]
+            assert "链接未能验证（TLS证书错误）" in lines[7]
+            assert "链接未能验证（无法连接）" in lines[8]
+            if len(source_lines)>8:
+                assert "链接未能验证（TLS证书错误）" in lines[9]
+            assert "[Source 20]⚠️(来源缺失)" in annotated
+            assert results[f"{base}/ok"].status==200 and not results[f"{base}/ok"].from_cache
+            assert results[f"{base}/missing"].status==404 and results[f"{base}/missing"].dead
+            assert results["https://no-such-host.invalid/report"].reason=="dns_error"
+            assert not results["http://127.0.0.1:1/report"].dead
+            assert all(agent.startswith("Mozilla/5.0") for agent in user_agents)
+
+            _,results=asyncio.run(verify_citations(report,fetcher))
+            print({url:(result.status,result.reason,result.from_cache) for url,result in results.items()})
+            #第二次通过ETag重新验证得到304，沿用缓存结果
+            assert results[f"{base}/ok"].status==200 and results[f"{base}/ok"].from_cache
+            assert results[f"{base}/missing"].status==404 and not results[f"{base}/missing"].from_cache
+            assert results["https://no-such-host.invalid/report"].reason=="dns_error"
+            #未验证的结果不写缓存
+            assert not results[f"{base}/forbidden"].from_cache
+            assert not fetcher._cache_file("http://127.0.0.1:1/report").exists()
+            assert not fetcher._cache_file(f"https://127.0.0.1:{servers[0].server_port}/ok").exists()
+            print("citation checker stand-in checks passed")
+        finally:
+            for server in servers:
+                server.shutdown()
@@ -1,4 +1,5 @@
-from dataclasses import dataclass,asdict
+from dataclasses import dataclass
+from collections import OrderedDict
 from datetime import datetime
 from typing import List,Tuple,Dict,Optional
 import uuid
@@ -15,14 +16,16 @@ data_dir.mkdir(parents=True,exist_ok=True)
 
 sys.path.insert(0,str(backend_root))
 
+from report_builder import ResearchReport
+
 logging.basicConfig(level=logging.INFO)
 logger=logging.getLogger(__name__)
 
 
 
-@dataclass
+@dataclass(slots=True)
 class SingleConversation:
-    """单轮对话数据结构定义"""
+    """单轮对话数据结构定义，使用__slots__减少大量轮次时的内存开销"""
     user_query:str
     ai_response:str
     timestamp:str
@@ -32,7 +35,16 @@ class SingleConversation:
     error_message:str=''
 
     def to_dict(self):
-        return asdict(self)
+        #浅拷贝字段即可，字段均为不可变类型，不需要asdict的深拷贝
+        return {name:getattr(self,name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls,data:dict)->"SingleConversation":
+        return cls(**data)
+
+    def memory_size(self)->int:
+        """估算该轮对话占用的内存字节数"""
+        return sys.getsizeof(self)+sum(sys.getsizeof(getattr(self,name)) for name in self.__slots__)
     
 @dataclass
 class ConversationSession:
@@ -42,15 +54,74 @@ class ConversationSession:
     turns:List[SingleConversation]
     total_tokens:int=0
     last_activity:str=''
+    report:Optional[ResearchReport]=None #当前会话最新的分章节研究报告，追问时只更新涉及的章节
+    memory_bytes:int=0 #turns与report的估算内存占用，由ConversationManager维护
 
     def to_dict(self):
-        return asdict(self)
+        data=self.to_dict_header()
+        data["turns"]=[turn.to_dict() for turn in self.turns]
+        return data
+
+    def to_dict_header(self)->dict:
+        """除turns以外的会话字段"""
+        return {
+            "session_id":self.session_id,
+            "created_at":self.created_at,
+            "total_tokens":self.total_tokens,
+            "last_activity":self.last_activity,
+            "report":self.report.to_dict() if self.report else None,
+        }
+
+    @classmethod
+    def from_dict(cls,data:dict)->"ConversationSession":
+        report=data.get("report")
+        return cls(
+            session_id=data["session_id"],
+            created_at=data["created_at"],
+            turns=[SingleConversation.from_dict(turn) for turn in data.get("turns",[])],
+            total_tokens=data.get("total_tokens",0),
+            last_activity=data.get("last_activity",''),
+            report=ResearchReport.from_dict(report) if report else None,
+        )
+
+    def recompute_memory(self)->int:
+        self.memory_bytes=sum(turn.memory_size() for turn in self.turns)+_report_memory_size(self.report)
+        return self.memory_bytes
+
+    def write_json(self,f):
+        """逐轮写出JSON，避免先在内存中构建整个会话字典"""
+        f.write("{\n")
+        for key,value in self.to_dict_header().items():
+            f.write(f"    {json.dumps(key)}: {_indent_json(value)},\n")
+        f.write('    "turns": [')
+        for index,turn in enumerate(self.turns):
+            f.write("," if index else "")
+            f.write(f"\n        {_indent_json(turn.to_dict(),level=2)}")
+        f.write("\n    ]\n}" if self.turns else "]\n}")
+
+
+def _indent_json(value,level:int=1)->str:
+    return json.dumps(value,indent=4,ensure_ascii=False).replace("\n","\n"+"    "*level)
+
+
+def _report_memory_size(report:Optional[ResearchReport])->int:
+    if not report:
+        return 0
+    return sum(
+        sys.getsizeof(section.content)+sum(sys.getsizeof(url) for url in section.sources)
+        for section in report.sections.values()
+    )
     
 class ConversationManager:
-    def __init__(self,max_history_length:int=10, max_session_age_hours:int=12):
+    def __init__(self,max_history_length:int=10, max_session_age_hours:int=12,max_memory_mb:float=256):
         self.max_history_length=max_history_length
         self.max_session_age_hours=max_session_age_hours
-        self.sessions:Dict[str,ConversationSession]={}
+        self.max_memory_bytes=int(max_memory_mb*1024*1024)
+        #按最近使用顺序排列，队首为最久未使用的会话
+        self.sessions:"OrderedDict[str,ConversationSession]"=OrderedDict()
+        #已换出到磁盘的会话：session_id -> (文件路径, 创建时间)
+        self.evicted_sessions:Dict[str,Tuple[Path,str]]={}
+        self.total_memory_bytes=0
         self.active_session_id:Optional[str]=None
     def create_session(self)->str:
 
@@ -82,6 +153,8 @@ class ConversationManager:
             session.turns.pop(0) #这个操作其实是O(n)的，但是因为会话轮次不会太多，所以可以接受
             logger.info(f"会话{session.session_id}达到最大历史长度，移除最早对话")
         logger.info(f"添加对话轮次：{last_single_conversation.turn_number}")
+        self._update_memory(session)
+        self.enforce_memory_limit()
 
         return True
     
@@ -100,9 +173,36 @@ class ConversationManager:
         )
     def get_active_session(self):
         if self.active_session_id and self.active_session_id in self.sessions:
+           self.sessions.move_to_end(self.active_session_id) #标记为最近使用
            return self.sessions.get(self.active_session_id)
         return None
+
+    def switch_session(self,session_id:str)->bool:
+        """切换活跃会话，已换出到磁盘的会话会被重新加载"""
+        if session_id in self.evicted_sessions:
+            self._restore_session(session_id)
+        if session_id not in self.sessions:
+            logger.warning(f"会话不存在：{session_id}")
+            return False
+        self.active_session_id=session_id
+        self.sessions.move_to_end(session_id)
+        self.enforce_memory_limit()
+        return True
     
+    def get_active_report(self)->Optional[ResearchReport]:
+        session=self.get_active_session()
+        return session.report if session else None
+
+    def set_active_report(self,report:ResearchReport)->bool:
+        session=self.get_active_session()
+        if not session:
+            logger.warning("没有活跃会话，无法保存报告")
+            return False
+        session.report=report
+        self._update_memory(session)
+        self.enforce_memory_limit()
+        return True
+
     def get_conversaion_history(self)->List[Tuple[str,str]]:
         """返回当前调用之前的所有对话历史，格式化为(用户消息,AI回复)的元组列表"""
         session=self.get_active_session()
@@ -133,7 +233,7 @@ class ConversationManager:
     
     def clear_session(self):
         if self.active_session_id:
-            del self.sessions[self.active_session_id]
+            self._drop_session(self.active_session_id)
             self.active_session_id=None
             logger.info("当前会话已清空")
             return True
@@ -147,14 +247,17 @@ class ConversationManager:
         # 设定文件路径
         
         with open(data_dir/filepath,'w', encoding='utf-8') as f:
-            json.dump(session.to_dict(),f,indent=4,ensure_ascii=False)
+            session.write_json(f)
         logger.info(f"会话已导出到：{filepath}")
         return f"会话已导出到文件：{filepath}"
 
     def is_session_expired(self,session:ConversationSession)->bool:
 
+        return self._is_expired_at(session.created_at)
+
+    def _is_expired_at(self,created_at:str)->bool:
         #当前时间-创建时间 是否超过 max_session_age_hours
-        created_time=datetime.fromisoformat(session.created_at)
+        created_time=datetime.fromisoformat(created_at)
         current_time=datetime.now()
         duration=(current_time-created_time).total_seconds()/3600
         return duration>self.max_session_age_hours
@@ -165,14 +268,72 @@ class ConversationManager:
         for session_id,session in self.sessions.items():
             if self.is_session_expired(session):
                 expired_session_ids.append(session_id)
+        for session_id,(_,created_at) in self.evicted_sessions.items():
+            if self._is_expired_at(created_at):
+                expired_session_ids.append(session_id)
         for session_id in expired_session_ids:
-            del self.sessions[session_id]
+            self._drop_session(session_id)
             if session_id==self.active_session_id: #同步更新
                 self.active_session_id=None
         num_expired=len(expired_session_ids)
         logger.info(f"清理了{num_expired}个过期会话")
 
         return num_expired
+
+    def enforce_memory_limit(self)->int:
+        """总内存超过上限时，按最久未使用顺序把空闲会话换出到磁盘，返回换出的会话数"""
+        evicted=0
+        for session_id in list(self.sessions):
+            if self.total_memory_bytes<=self.max_memory_bytes:
+                break
+            if session_id==self.active_session_id: #活跃会话不换出
+                continue
+            self.evict_session(session_id)
+            evicted+=1
+        if self.total_memory_bytes>self.max_memory_bytes:
+            logger.warning(f"会话内存占用{self.total_memory_bytes}字节仍超过上限，仅剩活跃会话")
+        return evicted
+
+    def evict_session(self,session_id:str)->Path:
+        """把会话写入磁盘并从内存中移除"""
+        session=self.sessions.pop(session_id)
+        session_dir=data_dir/'sessions'
+        session_dir.mkdir(parents=True,exist_ok=True)
+        path=session_dir/f"{session_id}.json"
+        with open(path,'w',encoding='utf-8') as f:
+            session.write_json(f)
+        self.total_memory_bytes-=session.memory_bytes
+        self.evicted_sessions[session_id]=(path,session.created_at)
+        logger.info(f"会话{session_id}已换出到磁盘：{path}")
+        return path
+
+    def get_memory_stats(self)->Dict[str,int]:
+        return {
+            "resident_sessions":len(self.sessions),
+            "evicted_sessions":len(self.evicted_sessions),
+            "total_memory_bytes":self.total_memory_bytes,
+            "max_memory_bytes":self.max_memory_bytes,
+        }
+
+    def _restore_session(self,session_id:str):
+        path,_=self.evicted_sessions.pop(session_id)
+        with open(path,'r',encoding='utf-8') as f:
+            session=ConversationSession.from_dict(json.load(f))
+        path.unlink(missing_ok=True)
+        self.sessions[session_id]=session
+        self._update_memory(session)
+        logger.info(f"会话{session_id}已从磁盘恢复")
+
+    def _update_memory(self,session:ConversationSession):
+        previous=session.memory_bytes
+        self.total_memory_bytes+=session.recompute_memory()-previous
+
+    def _drop_session(self,session_id:str):
+        if session_id in self.sessions:
+            self.total_memory_bytes-=self.sessions.pop(session_id).memory_bytes
+        if session_id in self.evicted_sessions:
+            path,_=self.evicted_sessions.pop(session_id)
+            path.unlink(missing_ok=True)
     
 class ConversationTimer:
     def __init__(self):
@@ -1,7 +1,8 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from agent_core import agent_executor
+from agent_core import create_agent_executor
+from request_coalescer import RequestCoalescer
 from datetime import datetime
 #creat fastapi instance
 
@@ -21,6 +22,11 @@ app.add_middleware(
 
 )
 
+# 相同主题的并发请求只运行一次Agent，短时间内的重复请求直接返回缓存结果
+# API是无状态的，Agent不带对话记忆，缓存结果只取决于主题
+agent_executor=create_agent_executor(use_memory=False)
+research_coalescer=RequestCoalescer(ttl_seconds=300)
+
 # Define request model
 class QueryRequest(BaseModel):
     topic:str
@@ -30,11 +36,15 @@ class QueryRequest(BaseModel):
 @app.post("/api/research")
 async def research_agent(request:QueryRequest):
     try:
-        response=await agent_executor.ainvoke({
-            "input":request.topic,
-            "current_time":datetime.now().strftime("%Y年%m月%d日")
-        })
-        return {"result":response['output']}
+        async def run_agent():
+            response=await agent_executor.ainvoke({
+                "input":request.topic,
+                "current_time":datetime.now().strftime("%Y年%m月%d日"),
+                "chat_history":[]
+            })
+            yield response['output']
+        result=await research_coalescer.run(request.topic,run_agent)
+        return {"result":result}
     except Exception as e:
         return {f"Error: Agent Execution {e}"}
     
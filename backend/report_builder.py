@@ -0,0 +1,360 @@
+from dataclasses import dataclass,field,asdict
+from datetime import datetime
+from typing import List,Dict,Optional,AsyncIterator,Any
+import asyncio
+import logging
+import re
+
+logging.basicConfig(level=logging.INFO)
+logger=logging.getLogger(__name__)
+
+
+@dataclass
+class SectionSpec:
+    """报告章节定义：标题、追问匹配关键词、取证查询和写作要求"""
+    key:str
+    title:str
+    keywords:List[str]
+    queries:List[str]
+    guidance:str
+    depends_on:List[str]=field(default_factory=list)
+
+
+#与agent_core.template_content中的输出格式保持一致
+REPORT_SECTIONS:List[SectionSpec]=[
+    SectionSpec(
+        key="overview",
+        title="一、 行业概览",
+        keywords=["行业概览","行业定义","市场规模","供需","发展阶段","发展周期"],
+        queries=["web_search:{topic} 行业定义 市场规模 {year}","web_search:{topic} 供需现状 发展阶段"],
+        guidance=(
+            "-   **行业定义:** [对行业的精确定义]\n"
+            "-   **市场规模:** [市场规模数据，并注明来源]\n"
+            "-   **供需现状:** [行业的供给和需求情况]\n"
+            "-   **发展阶段与周期:** [行业目前所处的发展阶段，如初创期、成长期、成熟期等]"
+        ),
+    ),
+    SectionSpec(
+        key="pest",
+        title="二、 宏观环境分析 (PEST)",
+        keywords=["PEST","宏观环境","政策环境","政治环境","经济环境","社会环境","技术环境"],
+        queries=["web_search:{topic} 相关政策 监管 {year}","web_search:{topic} 宏观经济 影响","arxiv_search:{topic}"],
+        guidance=(
+            "-   **政策环境 (Political):** [相关政策影响]\n"
+            "-   **经济环境 (Economic):** [宏观经济影响]\n"
+            "-   **社会环境 (Social):** [社会文化因素影响]\n"
+            "-   **技术环境 (Technological):** [关键技术驱动或制约]"
+        ),
+    ),
+    SectionSpec(
+        key="value_chain",
+        title="三、 产业链与价值链分析",
+        keywords=["产业链","价值链","上游","中游","下游"],
+        queries=["web_search:{topic} 产业链 上游 中游 下游 代表企业","web_search:{topic} 价值链 利润分布"],
+        guidance=(
+            "### 3.1 产业链结构\n"
+            "-   **上游:** [上游环节和代表性企业]\n"
+            "-   **中游:** [中游环节和代表性企业]\n"
+            "-   **下游:** [下游环节和代表性企业]\n\n"
+            "### 3.2 价值链分析\n"
+            "-   [价值如何在产业链中流动和增值]"
+        ),
+    ),
+    SectionSpec(
+        key="summary",
+        title="四、 总结与展望",
+        keywords=["总结与展望","总结","展望"],
+        queries=[],
+        guidance="[对整个行业进行总结，并对未来趋势做出展望]",
+        depends_on=["overview","pest","value_chain"],
+    ),
+]
+
+SECTION_SPECS:Dict[str,SectionSpec]={spec.key:spec for spec in REPORT_SECTIONS}
+
+section_prompt='''
+你是一个世界一流的行业研究分析师，正在撰写关于「{topic}」的行业研究报告中的一个章节。
+当前时间：{current_time}。
+
+请只撰写章节「{title}」的正文（不要输出章节标题），严格遵循以下 Markdown 格式：
+{guidance}
+
+**规则：**
+1. 只能使用下方提供的资料，绝对禁止编造数据和事实；资料不足时明确说明"暂无可靠数据"。
+2. 引用资料时在句末使用资料编号，例如 [Source 1]，编号必须来自下方资料列表。
+3. 使用中文回答。
+{extra}
+**资料：**
+{evidence}
+'''
+
+
+@dataclass
+class ReportSection:
+    """报告中的单个章节"""
+    key:str
+    title:str
+    content:str=''
+    sources:List[str]=field(default_factory=list)
+    updated_at:str=''
+    revision:int=0
+
+    def to_dict(self):
+        return asdict(self)
+
+
+@dataclass
+class ResearchReport:
+    """分章节保存的研究报告，可整体渲染也可只更新某个章节"""
+    topic:str
+    generated_at:str
+    sections:Dict[str,ReportSection]=field(default_factory=dict)
+
+    def __post_init__(self):
+        for spec in REPORT_SECTIONS:
+            self.sections.setdefault(spec.key,ReportSection(key=spec.key,title=spec.title))
+
+    def set_section(self,key:str,content:str,sources:Optional[List[str]]=None):
+        section=self.sections[key]
+        section.content=content.strip()
+        section.sources=list(sources or [])
+        section.updated_at=datetime.now().isoformat()
+        section.revision+=1
+
+    def is_complete(self)->bool:
+        return all(section.content for section in self.sections.values())
+
+    def all_sources(self)->List[str]:
+        """按章节顺序去重后的全部来源URL，其下标+1即为全局Source编号"""
+        seen=[]
+        for spec in REPORT_SECTIONS:
+            for url in self.sections[spec.key].sources:
+                if url not in seen:
+                    seen.append(url)
+        return seen
+
+    def render(self)->str:
+        """渲染为与template_content输出格式一致的Markdown，未完成的章节显示占位"""
+        global_sources=self.all_sources()
+        rendered=f"# 关于「{self.topic}」的行业研究报告\n\n"
+        rendered+=f"**报告生成时间:** {self.generated_at}\n\n---\n\n"
+        for spec in REPORT_SECTIONS:
+            section=self.sections[spec.key]
+            rendered+=f"## {section.title}\n\n"
+            if section.content:
+                rendered+=_renumber_sources(section.content,section.sources,global_sources)+"\n\n"
+            else:
+                rendered+="*（本章节正在生成中...）*\n\n"
+        rendered+="---\n### ※ 引用信息来源\n\n"
+        for index,url in enumerate(global_sources):
+            rendered+=f"-   **[Source {index+1}]:** {url}\n"
+        return rendered
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls,data:dict)->"ResearchReport":
+        sections={key:ReportSection(**value) for key,value in data.get("sections",{}).items()}
+        return cls(topic=data["topic"],generated_at=data["generated_at"],sections=sections)
+
+    @classmethod
+    def from_markdown(cls,topic:str,text:str,generated_at:str='')->"ResearchReport":
+        """把Agent一次性生成的Final Answer拆分为分章节报告"""
+        report=cls(topic=topic,generated_at=generated_at or datetime.now().strftime("%Y年%m月%d日"))
+        source_block=re.split(r"###\s*※\s*引用信息来源",text,maxsplit=1)
+        numbered=_parse_source_list(source_block[1]) if len(source_block)>1 else {}
+        global_sources=[numbered.get(n,'') for n in range(1,max(numbered,default=0)+1)]
+        for spec in REPORT_SECTIONS:
+            #按章节序号(一、二、...)定位，截止到下一个二级标题或来源列表
+            pattern=rf"##\s*{re.escape(spec.title.split()[0])}[^\n]*\n(.*?)(?=\n##\s|\n---\s*\n###|\Z)"
+            match=re.search(pattern,source_block[0],re.S)
+            if not match:
+                continue
+            body=_mark_missing_citations(match.group(1).strip().rstrip("-").strip(),numbered.keys())
+            local=list(dict.fromkeys(numbered[n] for n in _cited_numbers(body) if n in numbered))
+            report.set_section(spec.key,_renumber_sources(body,global_sources,local),local)
+        return report
+
+
+def _cited_numbers(text:str)->List[int]:
+    return [int(n) for n in re.findall(r"\[(?:Source|Src)\s*(\d+)\]",text)]
+
+
+def _mark_missing_citations(text:str,valid_numbers)->str:
+    """把编号不在valid_numbers中的[Source N]改写为[来源缺失]"""
+    valid=set(valid_numbers)
+    return re.sub(r"\[(?:Source|Src)\s*(\d+)\]",lambda match:match.group(0) if int(match.group(1)) in valid else "[来源缺失]",text)
+
+
+def _strip_citations(text:str)->str:
+    return re.sub(r"\s*\[(?:(?:Source|Src)\s*\d+|来源缺失)\]","",text)
+
+
+def _parse_source_list(text:str)->Dict[int,str]:
+    sources={}
+    #来源可能写成裸URL、<url>或Markdown链接[标题](url)
+    pattern=r"\[(?:Source|Src)\s*(\d+)\]\**:?\**[ \t]*(?:\[[^\]\n]*\]\(([^)\s]+)\)|<([^>\s]+)>|(\S+))"
+    for number,link_url,bracket_url,bare_url in re.findall(pattern,text):
+        sources[int(number)]=link_url or bracket_url or bare_url
+    return sources
+
+
+def _renumber_sources(content:str,from_sources:List[str],to_sources:List[str])->str:
+    """把content中基于from_sources的[Source N]编号改写为to_sources中的编号"""
+    def replace(match):
+        number=int(match.group(1))
+        if 1<=number<=len(from_sources) and from_sources[number-1] in to_sources:
+            return f"[Source {to_sources.index(from_sources[number-1])+1}]"
+        #无法映射的编号保留原值会指向无关来源
+        return "[来源缺失]"
+    return re.sub(r"\[(?:Source|Src)\s*(\d+)\]",replace,content)
+
+
+def match_sections(question:str)->List[str]:
+    """根据追问内容判断涉及哪些章节，未命中任何章节时返回空列表
+
+    关键词只使用章节专属术语，只有明确点名某个章节的追问才会局部重写，其他追问交给Agent回答
+    """
+    lowered=question.lower()
+    return [spec.key for spec in REPORT_SECTIONS if any(word.lower() in lowered for word in spec.keywords)]
+
+
+class ReportBuilder:
+    """按章节生成研究报告：每个章节在自己的资料检索完成后立即生成，互不等待"""
+    def __init__(self,llm,tools:List[Any],max_evidence_chars:int=6000):
+        self.llm=llm
+        self.tools={tool.name:tool for tool in tools}
+        self.max_evidence_chars=max_evidence_chars
+
+    async def gather_evidence(self,spec:SectionSpec,topic:str,question:str='')->List[Dict[str,str]]:
+        """并发执行章节的检索查询，返回[{url,content}]资料列表"""
+        year=datetime.now().year
+        calls=[]
+        for query in spec.queries:
+            tool_name,query_text=query.split(":",1)
+            tool=self.tools.get(tool_name)
+            if tool is None:
+                continue
+            query_text=query_text.format(topic=topic,year=year)
+            if question:
+                query_text=f"{query_text} {question}"
+            calls.append(tool.ainvoke(query_text))
+        evidence=[]
+        for result in await asyncio.gather(*calls,return_exceptions=True):
+            if isinstance(result,Exception):
+                logger.warning(f"章节{spec.key}检索失败: {result}")
+                continue
+            evidence.extend(_normalize_observation(result))
+        return evidence
+
+    async def generate_section(self,report:ResearchReport,key:str,current_time:str,question:str='')->ReportSection:
+        """检索并生成单个章节，结果直接写入report"""
+        spec=SECTION_SPECS[key]
+        if spec.depends_on:
+            evidence_text,sources=self._format_dependencies(report,spec)
+        else:
+            evidence=await self.gather_evidence(spec,report.topic,question)
+            evidence_text,sources=self._format_evidence(evidence)
+        extra=''
+        if question:
+            extra=f"4. 这是对已有章节的更新，请重点回应用户追问：「{question}」。\n"
+            if report.sections[key].content:
+                #原有内容的来源编号与本次资料编号无关，去掉以免被照抄
+                extra+=f"**该章节原有内容：**\n{_strip_citations(report.sections[key].content)}\n"
+        prompt=section_prompt.format(
+            topic=report.topic,current_time=current_time,title=spec.title,
+            guidance=spec.guidance,extra=extra,evidence=evidence_text or "（未检索到资料）"
+        )
+        response=await self.llm.ainvoke(prompt)
+        content=str(getattr(response,"content",response))
+        #资料列表中不存在的编号在全局编号下会指向无关来源，改为显式的缺失标记
+        content=_mark_missing_citations(content,range(1,len(sources)+1))
+        #只保留正文实际引用的来源，并按引用顺序重新编号
+        cited=list(dict.fromkeys(sources[n-1] for n in _cited_numbers(content) if 1<=n<=len(sources)))
+        report.set_section(key,_renumber_sources(content,sources,cited),cited)
+        logger.info(f"章节生成完成：{spec.title}")
+        return report.sections[key]
+
+    async def astream_report(self,topic:str,current_time:str)->AsyncIterator[ResearchReport]:
+        """生成完整报告，每完成一个章节就产出一次当前报告"""
+        report=ResearchReport(topic=topic,generated_at=current_time)
+        yield report
+        independent=[spec.key for spec in REPORT_SECTIONS if not spec.depends_on]
+        tasks=[asyncio.create_task(self.generate_section(report,key,current_time)) for key in independent]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                await finished
+                yield report
+        finally:
+            for task in tasks:
+                task.cancel()
+        for spec in REPORT_SECTIONS:
+            if spec.depends_on:
+                await self.generate_section(report,spec.key,current_time)
+                yield report
+
+    async def astream_update(self,report:ResearchReport,keys:List[str],question:str,current_time:str)->AsyncIterator[ResearchReport]:
+        """只重新生成追问涉及的章节；依赖这些章节的总结类章节随后一并刷新"""
+        direct=[key for key in keys if not SECTION_SPECS[key].depends_on]
+        tasks=[asyncio.create_task(self.generate_section(report,key,current_time,question)) for key in direct]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                await finished
+                yield report
+        finally:
+            for task in tasks:
+                task.cancel()
+        for spec in REPORT_SECTIONS:
+            if spec.depends_on and (spec.key in keys or set(spec.depends_on)&set(direct)):
+                await self.generate_section(report,spec.key,current_time,question if spec.key in keys else '')
+                yield report
+
+    def _format_dependencies(self,report:ResearchReport,spec:SectionSpec):
+        """把被依赖章节的内容改写为统一编号后作为资料，返回(资料文本, 统一编号对应的来源URL列表)"""
+        sources=[]
+        for dep in spec.depends_on:
+            for url in report.sections[dep].sources:
+                if url not in sources:
+                    sources.append(url)
+        lines=[
+            f"{report.sections[dep].title}\n{_renumber_sources(report.sections[dep].content,report.sections[dep].sources,sources)}"
+            for dep in spec.depends_on if report.sections[dep].content
+        ]
+        lines+=[f"[Source {index+1}] {url}" for index,url in enumerate(sources)]
+        return "\n\n".join(lines),sources
+
+    def _format_evidence(self,evidence:List[Dict[str,str]]):
+        """资料编号从1开始，返回(资料文本, 对应来源URL列表)"""
+        lines=[]
+        sources=[]
+        used=0
+        for item in evidence:
+            content=item.get("content",'').strip()
+            if not content or used>=self.max_evidence_chars:
+                continue
+            content=content[:self.max_evidence_chars-used]
+            used+=len(content)
+            url=item.get("url",'')
+            if url:
+                if url not in sources:
+                    sources.append(url)
+                lines.append(f"[Source {sources.index(url)+1}] {url}\n{content}")
+            else:
+                lines.append(content)
+        return "\n\n".join(lines),sources
+
+
+def _normalize_observation(observation)->List[Dict[str,str]]:
+    """把不同工具的返回值统一为[{url,content}]"""
+    if isinstance(observation,dict):
+        results=observation.get("results")
+        if isinstance(results,list):
+            return [
+                {"url":item.get("url",''),"content":f"{item.get('title','')}\n{item.get('content','')}"}
+                for item in results if isinstance(item,dict)
+            ]
+        return [{"url":'',"content":str(observation)}]
+    if isinstance(observation,list):
+        return [entry for item in observation for entry in _normalize_observation(item)]
+    return [{"url":'',"content":str(observation)}]
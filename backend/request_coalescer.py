@@ -0,0 +1,132 @@
+from dataclasses import dataclass,field
+from typing import Any,AsyncIterator,Callable,Dict,List,Optional,Tuple
+import asyncio
+import logging
+import re
+import time
+import unicodedata
+
+logging.basicConfig(level=logging.INFO)
+logger=logging.getLogger(__name__)
+
+_TRAILING_PUNCTUATION="?？!！。.,，;；:：~～…"
+_CJK_SPACE_PATTERN=re.compile(r"(?<=[一-鿿])\s+(?=[一-鿿])")
+_FLIGHT_END=object() #运行结束标记
+
+
+def normalize_topic(topic:str)->str:
+    """把研究主题规范化为合并键：统一全角半角和大小写，去掉多余空白和句末标点"""
+    normalized=unicodedata.normalize("NFKC",topic).lower().strip()
+    normalized=re.sub(r"\s+"," ",normalized)
+    normalized=_CJK_SPACE_PATTERN.sub("",normalized)
+    return normalized.rstrip(_TRAILING_PUNCTUATION+" ")
+
+
+@dataclass
+class _Flight:
+    """一次正在进行的运行，以及等待它结果的订阅者"""
+    key:str
+    latest:Any=None
+    has_value:bool=False
+    error:Optional[BaseException]=None
+    subscribers:List[asyncio.Queue]=field(default_factory=list)
+    task:Optional[asyncio.Task]=None
+
+
+class RequestCoalescer:
+    """合并相同主题的并发请求：同一时刻每个主题只运行一次，流式结果分发给所有等待者
+
+    producer产出的每个结果都应是完整快照（例如渲染后的整份报告），
+    中途加入的等待者会先收到最新快照，再接着收到后续快照。
+    运行结束后最终结果在ttl_seconds内直接返回给后来的相同请求。
+    """
+    def __init__(self,ttl_seconds:float=300,max_cached_results:int=128):
+        self.ttl_seconds=ttl_seconds
+        self.max_cached_results=max_cached_results
+        self._flights:Dict[str,_Flight]={}
+        self._results:Dict[str,Tuple[float,Any]]={}
+
+    async def stream(self,topic:str,producer:Callable[[],AsyncIterator[Any]])->AsyncIterator[Any]:
+        key=normalize_topic(topic)
+        cached=self._get_cached(key)
+        if cached is not None:
+            logger.info(f"命中结果缓存：{key}")
+            yield cached
+            return
+
+        flight=self._flights.get(key)
+        if flight is None:
+            flight=_Flight(key=key)
+            self._flights[key]=flight
+            flight.task=asyncio.create_task(self._run(flight,producer))
+        else:
+            logger.info(f"合并到进行中的请求：{key}（当前等待者{len(flight.subscribers)+1}个）")
+
+        queue:asyncio.Queue=asyncio.Queue()
+        if flight.has_value:
+            queue.put_nowait(flight.latest)
+        flight.subscribers.append(queue)
+        try:
+            while True:
+                item=await queue.get()
+                if item is _FLIGHT_END:
+                    break
+                yield item
+        finally:
+            flight.subscribers.remove(queue)
+        if flight.error is not None:
+            raise flight.error
+
+    async def run(self,topic:str,producer:Callable[[],AsyncIterator[Any]])->Any:
+        """非流式调用，返回最终结果"""
+        result=None
+        async for result in self.stream(topic,producer):
+            pass
+        return result
+
+    async def _run(self,flight:_Flight,producer:Callable[[],AsyncIterator[Any]]):
+        #等待者断开不会取消运行，其他等待者和结果缓存仍需要它
+        try:
+            async for item in producer():
+                flight.latest=item
+                flight.has_value=True
+                for queue in flight.subscribers:
+                    queue.put_nowait(item)
+            if flight.has_value:
+                self._store_result(flight.key,flight.latest)
+        except Exception as e:
+            logger.error(f"合并请求运行失败 {flight.key}: {e}")
+            flight.error=e
+        except asyncio.CancelledError:
+            #运行被取消（例如服务关闭）时等待者不能当作成功处理
+            logger.warning(f"合并请求运行被取消 {flight.key}")
+            flight.error=RuntimeError(f"请求「{flight.key}」的运行已被取消")
+            raise
+        finally:
+            del self._flights[flight.key]
+            for queue in flight.subscribers:
+                queue.put_nowait(_FLIGHT_END)
+
+    def _get_cached(self,key:str)->Any:
+        entry=self._results.get(key)
+        if entry is None:
+            return None
+        stored_at,result=entry
+        if time.monotonic()-stored_at>self.ttl_seconds:
+            del self._results[key]
+            return None
+        return result
+
+    def _store_result(self,key:str,result:Any):
+        self._results[key]=(time.monotonic(),result)
+        #超过容量时淘汰最早写入的结果
+        while len(self._results)>self.max_cached_results:
+            del self._results[next(iter(self._results))]
+
+    def get_stats(self)->Dict[str,int]:
+        return {
+            "in_flight":len(self._flights),
+            "waiters":sum(len(flight.subscribers) for flight in self._flights.values()),
+            "cached_results":len(self._results),
+        }
+